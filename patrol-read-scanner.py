@@ -1,38 +1,144 @@
 #!/usr/bin/env python3
 import argparse
+import ctypes
 import errno
+import itertools
 import json
+import logging
+import logging.handlers
+import mmap
 import multiprocessing as mp
 import os
+import platform
+import queue
+import struct
 import sys
+from os import POSIX_FADV_DONTNEED, POSIX_FADV_WILLNEED
 from pathlib import Path
 from syslog import syslog
-from time import sleep, perf_counter
+from time import sleep, monotonic, perf_counter
+
+
+logger = logging.getLogger("patrol-read-scanner")
+
+# ioprio_set(2) has no glibc wrapper, so it has to be invoked using syscall(2).
+# Syscall numbers depend on the ABI of this process, not just on the machine
+# architecture reported by the kernel (e.g. 32-bit Python on a 64-bit kernel),
+# so they are keyed by (machine, whether this process is 64-bit).
+SYS_IOPRIO_SET = {('x86_64', True): 251, ('x86_64', False): 289,
+                  ('i686', False): 289, ('i386', False): 289,
+                  ('aarch64', True): 30, ('aarch64', False): 314, ('armv7l', False): 314,
+                  ('ppc64le', True): 273, ('s390x', True): 282, ('riscv64', True): 30}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
 
 
 # This script's syslog output is meant to be watched by a logwatch.
-# I separated log functions like this to make it easier to keep the structure
+# All messages go through SyslogHandler to make it easier to keep the structure
 # of all messages in-sync with logwatch rules and to make accidental logwatch
-# breakage less likely. If the prefix strings used by log_*() are changed,
+# breakage less likely. If the prefix string used by SyslogHandler is changed,
 # make sure logwatch rules are updated as well.
-def log_info(msg: str): syslog(f"patrol-read-scanner INFO: {msg}")
-def log_warning(msg: str): syslog(f"patrol-read-scanner WARNING: {msg}")
-def log_error(msg: str): syslog(f"patrol-read-scanner ERROR: {msg}")
+class SyslogHandler(logging.Handler):
+    """Logging handler that sends records to syslog(3)"""
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(logging.Formatter("patrol-read-scanner %(levelname)s: %(message)s"))
+
+    def emit(self, record):
+        try:
+            syslog(self.format(record))
+        except Exception:  # noqa
+            self.handleError(record)
+
 
+def configure_logging(handler: logging.Handler):
+    """Direct log records to handler. Children use a QueueHandler, whose queue is drained
+    by a QueueListener thread of the same child. This way scanning doesn't block on
+    syslog(), e.g. during a storm of I/O errors. Each child has its own in-process queue,
+    because a process killed while holding the lock of a queue shared between processes
+    would block logging in all other processes forever."""
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.handlers.clear()
+    logger.addHandler(handler)
 
-def scan_device_wrapper(*args, **kwargs):
+
+def set_idle_priority():
+    """Put the calling process into the idle CPU and I/O scheduling classes"""
+    try:
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+    except OSError as e:
+        # e.g. EPERM when syscalls are filtered (seccomp, sandboxed runtimes)
+        logger.warning("failed to set CPU scheduling policy: %s, consider running "
+                       "under `chrt --idle 0`", e.strerror)
+    abi = (platform.machine(), struct.calcsize("P") == 8)
+    if abi not in SYS_IOPRIO_SET:
+        logger.warning("don't know how to set I/O priority on %s, consider running "
+                       "under `ionice -c idle`", abi)
+        return
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.syscall(SYS_IOPRIO_SET[abi], IOPRIO_WHO_PROCESS, 0,
+                    IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) != 0:
+        # e.g. EPERM or ENOSYS when syscalls are filtered (seccomp, containers)
+        logger.warning("failed to set I/O priority: %s, consider running "
+                       "under `ionice -c idle`", os.strerror(ctypes.get_errno()))
+
+
+def scan_device_wrapper(cpus: set, min_scan_interval: float, idle: bool, *args, **kwargs):
+    """Scan device over and over until it disappears, starting scans at most every
+    min_scan_interval seconds, in idle scheduling classes if idle is set. Runs in a child process."""
+    # undo the CPU pinning of the main process (before starting the listener thread)
+    os.sched_setaffinity(0, cpus)
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(log_queue, SyslogHandler())
+    log_listener.start()
+    configure_logging(logging.handlers.QueueHandler(log_queue))
+    path = args[0]
+    logger.info("scan path=%s", path)
     try:
-        return scan_device(*args, **kwargs)
+        if idle:
+            set_idle_priority()
+        while True:
+            scan_start = monotonic()
+            if not scan_device(*args, **kwargs):
+                break
+            # Don't rescan in a tight loop if the scan was very quick (e.g. a device
+            # whose capacity dropped to 0), which would also flood syslog.
+            sleep(max(0.0, scan_start + min_scan_interval - monotonic()))
+            logger.info("rescan dev=%s", path)
+            # only the first scan may start from the middle
+            kwargs['start_from_middle'] = False
     except Exception as e:  # noqa
-        log_error(f"Exception in child {args} {kwargs} {e}")
+        logger.error("Exception in child %s %s %s", args, kwargs, e)
         raise
+    finally:
+        # flush remaining records to syslog
+        log_listener.stop()
+
+
+def open_device(path: str, direct: bool = False):
+    """Open device for reading, advise the kernel about our access pattern, and return file descriptor"""
+    if direct:
+        # O_DIRECT bypasses the page cache and readahead. Don't give
+        # any advice, since it would only apply to buffered I/O.
+        return os.open(path, os.O_RDONLY | os.O_DIRECT)
+    fd = os.open(path, os.O_RDONLY)
+    # Make the kernel use a larger readahead window, so that our reads are serviced
+    # by fewer, larger I/Os. Pages are dropped from the page cache with
+    # POSIX_FADV_DONTNEED as soon as they have been read (see scan_device).
+    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    return fd
 
 
 def scan_device(path: str, read_size: int, delay: float, slow_read_threshold: float, problem_backoff: float,
-                start_from_middle: bool = False):
+                start_from_middle: bool = False, direct: bool = False, verbose: bool = False,
+                batch_reads: int = 1):
     """
     Perform a read scan of a device. Report I/O errors and slow reads. Sleep between reads.
-    Sleep after I/O errors and slow reads.
+    Sleep after I/O errors and slow reads. If the calling process runs in idle scheduling
+    classes (see set_idle_priority), the measured read latency includes time spent waiting
+    for the CPU and I/O schedulers.
 
     Args:
         path (str): /dev path to the device
@@ -41,66 +147,156 @@ def scan_device(path: str, read_size: int, delay: float, slow_read_threshold: fl
         slow_read_threshold (float): at what point to consider reads "slow"
         problem_backoff (float): sleep time after a slow read or I/O error is encountered
         start_from_middle (bool): begin scanning from the middle, rather than the beginning of the device
+        direct (bool): use O_DIRECT to bypass the page cache (read_size must be a multiple of page size)
+        verbose (bool): log scan parameters at the start of the scan
+        batch_reads (int): number of reads to perform between sleeps; sleep time is scaled accordingly
 
-    Returns: None
+    Returns: True if the scan was completed, False if the device disappeared
     """
-    log_info(f"starting a new scan path={path} read_size={read_size} delay={delay} "
-             f"slow_read_threshold={slow_read_threshold} problem_backoff={problem_backoff} "
-             f"start_from_middle={start_from_middle}")
-    dev = open(path, "rb", buffering=0)
+    if verbose:
+        logger.info("starting a new scan path=%s read_size=%d delay=%s slow_read_threshold=%s "
+                    "problem_backoff=%s start_from_middle=%s direct=%s batch_reads=%d",
+                    path, read_size, delay, slow_read_threshold, problem_backoff, start_from_middle, direct,
+                    batch_reads)
+    try:
+        fd = open_device(path, direct)
+    except OSError as e:
+        if e.errno in (errno.ENXIO, errno.ENOENT):
+            # device was removed before or between scans
+            logger.error("Device %s disappeared", path)
+            return False
+        if not direct or e.errno != errno.EINVAL:
+            raise  # unexpected exception
+        logger.warning("O_DIRECT not supported dev=%s, falling back to buffered reads", path)
+        direct = False
+        fd = open_device(path)
+    # Read into a single preallocated buffer, rather than allocating a new bytes object
+    # for every read. Anonymous mmap is page-aligned, as required by O_DIRECT.
+    bufs = [mmap.mmap(-1, read_size)]
+    # Maintain the offset ourselves and use positional reads
+    # to avoid an lseek() system call per read.
+    offset = 0
     if start_from_middle:
-        size = dev.seek(0, os.SEEK_END)
+        size = os.lseek(fd, 0, os.SEEK_END)
         # stay aligned
-        dev.seek((int(size / 2) // read_size) * read_size)
+        offset = (int(size / 2) // read_size) * read_size
+    reads_since_sleep = 0
+    # whether a read of the current batch was slow or failed
+    problem_in_batch = False
+    # Format constant parts of per-read log messages once. The results are used as
+    # format strings, so any "%" in the path has to be escaped.
+    dev = str(path).replace('%', '%%')
+    io_error_fmt = f"I/O error dev={dev} start_pos=%d, read_size={read_size}"
+    slow_io_fmt = f"slow I/O dev={dev}, latency=%ss, start_pos=%d, read_size={read_size}"
+    # Local aliases avoid global and attribute lookups in the loop
+    preadv, fadvise, clock = os.preadv, os.posix_fadvise, perf_counter
     while True:
-        start_pos = dev.tell()
+        # Reads are deliberately synchronous and issued one at a time. Keeping
+        # more reads in flight (e.g. with io_uring) would increase the impact on
+        # other I/O, and the measured latency would include queueing delays,
+        # which would make slow read detection unreliable.
         try:
-            start_time = perf_counter()
-            bytes_read = dev.read(read_size)
-            latency = perf_counter() - start_time
+            start_time = clock()
+            bytes_read = preadv(fd, bufs, offset)
+            latency = clock() - start_time
+            if not direct:
+                # Data read during the scan will not be needed again. Drop it from
+                # the page cache so that it doesn't evict pages of other applications.
+                fadvise(fd, offset, read_size, POSIX_FADV_DONTNEED)
         except OSError as e:
+            if direct and e.errno == errno.EINVAL:
+                # Device doesn't accept our O_DIRECT reads (e.g. read_size is not
+                # a multiple of its logical block size).
+                logger.warning("O_DIRECT read failed dev=%s, falling back to buffered reads", path)
+                os.close(fd)
+                direct = False
+                fd = open_device(path)
+                continue
             if e.errno != errno.EIO:
                 raise  # unexpected exception
             # I/O error encountered
-            log_error(f"I/O error dev={dev.name} start_pos={start_pos}, read_size={read_size}")
+            logger.error(io_error_fmt, offset)
+            problem_in_batch = True
             # It's possible we got an I/O error not because of drive malfunction
             # but because it was removed from the system. To rule that out, try to
             # reopen the device.
-            dev.close()
+            os.close(fd)
             try:
-                dev = open(path, "rb", buffering=0)
+                fd = open_device(path, direct)
             except (OSError, FileNotFoundError) as e:
                 if e.errno not in (errno.ENXIO, errno.ENOENT):
                     raise  # unexpected exception
                 # "No such device or address" or "No such file or directory"
                 # (depending on whether the device file disappeared yet)
-                log_error(f"Device {dev.name} disappeared")
-                return
+                logger.error("Device %s disappeared", path)
+                return False
             # move forward but stay aligned
-            dev.seek(start_pos + read_size)
+            offset += read_size
             sleep(problem_backoff)
         # successful read
         else:
             if latency > slow_read_threshold:
-                log_warning(f"slow I/O dev={dev.name}, latency={latency}s, start_pos={start_pos}, "
-                            f"read_size={read_size}")
+                logger.warning(slow_io_fmt, latency, offset)
+                problem_in_batch = True
                 sleep(problem_backoff)
-            if len(bytes_read) == 0:
-                log_info(f"completed scan dev={dev.name}")
-                return
-        sleep(delay)
+            if bytes_read == 0:
+                os.close(fd)
+                # Sleep for the unfinished batch (including this read), so that
+                # back-to-back scans of a small device don't turn into a busy loop.
+                sleep((reads_since_sleep + 1) * delay)
+                return True
+            offset += bytes_read
+        # Sleep once per batch of reads, rather than after every read, to reduce
+        # the number of wakeups while keeping the same average read rate.
+        reads_since_sleep += 1
+        if reads_since_sleep < batch_reads:
+            continue
+        reads_since_sleep = 0
+        if not direct and not problem_in_batch:
+            # Start reading the next chunk while we sleep (Python has no readahead(2),
+            # but this has the same effect). If that read is slow, pread() will wait
+            # for it to complete, so slow reads are still reported, although
+            # the reported latency will be lower by up to the sleep time. Only the
+            # first read of the next batch is prefetched, since the others would
+            # complete unmeasured. Don't prefetch near a problem area, so that
+            # problem areas aren't read during the backoff or read twice.
+            fadvise(fd, offset, read_size, POSIX_FADV_WILLNEED)
+        problem_in_batch = False
+        sleep(batch_reads * delay)
+
+
+def read_sysfs_flag(path: str) -> bytes:
+    """Return contents of a sysfs file holding a single-digit value, e.g. b'1\\n'"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, 2)
+    finally:
+        os.close(fd)
 
 
 def discover_hdd_devices():
     """Return list of /dev device paths of hard disk drives"""
-    rotational_file_paths = list(Path('/sys/devices').glob('pci*/**/queue/rotational'))
-    rotational_device_names = set(path.parts[-3] for path in rotational_file_paths if path.read_bytes() == b'1\n')
-    # SD card readers, USB sticks, and virtual media (e.g. iDRAC) are considered
-    # to be rotational for some reason. Filter them out by looking at the "removable"
-    # file. This will also take care of CD drives.
-    removable_file_paths = [path.parents[1] / 'removable' for path in rotational_file_paths]
-    removable_device_names = set(path.parts[-2] for path in removable_file_paths if path.read_bytes() == b'1\n')
-    return [Path(f"/dev/{dev_name}") for dev_name in rotational_device_names - removable_device_names]
+    devpaths = []
+    # /sys/block has a symlink to the /sys/devices directory of every block device,
+    # which is much cheaper than searching /sys/devices.
+    for entry in os.scandir('/sys/block'):
+        # Only consider PCI devices. This excludes virtual devices, such as loop and md,
+        # which may claim to be rotational.
+        if not os.path.realpath(entry.path).startswith('/sys/devices/pci'):
+            continue
+        try:
+            if read_sysfs_flag(f"{entry.path}/queue/rotational") != b'1\n':
+                continue
+            # SD card readers, USB sticks, and virtual media (e.g. iDRAC) are considered
+            # to be rotational for some reason. Filter them out by looking at the "removable"
+            # file. This will also take care of CD drives.
+            if read_sysfs_flag(f"{entry.path}/removable") != b'0\n':
+                continue
+        except FileNotFoundError:
+            # device was removed while we were looking at it
+            continue
+        devpaths.append(Path(f"/dev/{entry.name}"))
+    return devpaths
 
 
 def main():
@@ -108,20 +304,25 @@ def main():
     default_readsize = 1024*128
     default_slowthreshold = 5
     default_problembackoff = 10
+    default_batchreads = 4
+    # Device discovery walks /sys, so don't do it on every iteration of the main loop
+    rediscovery_interval = 10
 
     parser = argparse.ArgumentParser(
         description="This script implements a form of a disk patrol read/scan "
                     "by sequentially reading disk device file(s) in an infinite "
                     "loop. Reads are performed with pauses to reduce impact on "
-                    "disk performance. To further reduce impact on performance "
-                    "consider running under `ionice -c idle`. The script is meant "
-                    "to run as a daemon and communicates via syslog. It reports "
-                    "read failures and abnormal read latencies.",
+                    "disk performance. To further reduce impact on performance, "
+                    "reads are performed using idle CPU and I/O scheduling classes "
+                    "(unless --no-idle is used). The script is meant to run as a "
+                    "daemon and communicates via syslog. It reports read failures "
+                    "and abnormal read latencies.",
         epilog=("Notes: [1] If device paths are not specified as arguments or in the "
                 "config file, the script will try to discover and use all spinning disks "
                 "(no HDDs will be missed, but some SSDs may be mistaken for HDDs). Removal "
-                "of a device will not result in an error, and if a device is added, the"
-                "script will start scanning it. Otherwise, if device paths are explicitly "
+                "of a device will not result in an error, and if a device is added, the "
+                "script will start scanning it (devices are rediscovered every "
+                f"{rediscovery_interval} iterations of the main loop). Otherwise, if device paths are explicitly "
                 "specified, the script will error out if a device is removed, and added "
                 "devices will be ignored. "
                 "[2] Attempts to read from a problematic area are likely to cause very "
@@ -144,12 +345,24 @@ def main():
     parser.add_argument("--readsize", metavar="BYTES", type=int,
                         help=f"read() size (default: {default_readsize})")
     parser.add_argument("--slowthreshold", metavar="SECONDS", type=float,
-                        help=f"slow read threshold (default: {default_slowthreshold})")
+                        help=f"slow read threshold; unless --no-idle is used, measured latency includes "
+                             f"time spent waiting for the CPU and I/O schedulers (default: {default_slowthreshold})")
     parser.add_argument("--problembackoff", metavar="SECONDS", type=float,
                         help=f"amount of time to sleep if an IO problem is encountered [2] "
                              f"(default={default_problembackoff})")
+    parser.add_argument("--batchreads", metavar="N", type=int,
+                        help=f"number of back-to-back reads between sleeps; the sleep time is "
+                             f"multiplied by N to maintain the read rate (default: {default_batchreads})")
+    parser.add_argument("--direct", action="store_true",
+                        help="use O_DIRECT to bypass the page cache; read size must be a multiple "
+                             "of the page size (default: off)")
+    parser.add_argument("--no-idle", action="store_true",
+                        help="don't use idle CPU and I/O scheduling classes for reads (default: off)")
+    parser.add_argument("--verbose", action="store_true",
+                        help="log parameters of every scan, rather than just the device path (default: off)")
     parser.add_argument("--main-loop-sleep", metavar="SECONDS", type=float, default=600,  # keep default in sync w/ help
-                        help="amount of time to sleep between checking up on child processes. "
+                        help="amount of time to sleep between checking up on child processes, "
+                             "and minimum time between starts of consecutive scans of a device. "
                              "This is intended for testing and cannot be configured from the "
                              "config file (default: 600)")
     parser.add_argument("--conf-file", metavar="PATH",
@@ -157,6 +370,20 @@ def main():
                              "arguments override config file values)")
     args = parser.parse_args()
 
+    # Unless --no-idle is used, children set their own scheduling priorities, so they
+    # don't depend on inheriting anything (e.g. ionice settings) from the main process.
+    mp.set_start_method("forkserver")
+
+    # The main process mostly sleeps, so pin it to a single CPU. On machines with
+    # many cores this avoids large multiprocessing overheads when starting children.
+    # Children restore the original CPU affinity. This has to be done before any threads
+    # are started, since sched_setaffinity() only pins the calling thread.
+    cpus = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, {min(cpus)})
+
+    # The main process mostly sleeps, so it logs to syslog directly
+    configure_logging(SyslogHandler())
+
     conf = {}
     # Attempt to load config from file.
     if args.conf_file:
@@ -171,45 +398,85 @@ def main():
     readsize = args.readsize if args.readsize else conf.get("readsize", default_readsize)
     slowthreshold = args.slowthreshold if args.slowthreshold else conf.get("slowthreshold", default_slowthreshold)
     problembackoff = args.problembackoff if args.problembackoff else conf.get("problembackoff", default_problembackoff)
+    batchreads = args.batchreads if args.batchreads is not None else conf.get("batchreads", default_batchreads)
+    direct = args.direct or conf.get("direct", False)
+    idle = not args.no_idle and conf.get("idle", True)
+    verbose = args.verbose or conf.get("verbose", False)
 
-    log_info(f"main thread starting devpaths={devpaths}, delay={delay}, readsize={readsize}, "
-             f"slowthreshold={slowthreshold}, problembackoff={problembackoff}")
+    logger.info("main thread starting devpaths=%s, delay=%s, readsize=%s, slowthreshold=%s, "
+                "problembackoff=%s, batchreads=%s, direct=%s, idle=%s, verbose=%s",
+                devpaths, delay, readsize, slowthreshold, problembackoff, batchreads, direct, idle, verbose)
+    discovered = [] if devpaths else discover_hdd_devices()
     if not devpaths:
-        log_info(f"initial set of discovered spinning disks: {sorted(discover_hdd_devices())}")
+        logger.info("initial set of discovered spinning disks: %s", sorted(discovered))
 
-    if not devpaths and not discover_hdd_devices():
-        log_error(f"no device paths specified and no spinning disks discovered")
+    if not devpaths and not discovered:
+        logger.error("no device paths specified and no spinning disks discovered")
         parser.error("Error: no device paths specified and no rotational devices discovered.")
 
-    # Use fork to start children in case we are run under ionice
-    # (not sure if other start methods preserve ionice settings).
-    mp.set_start_method("fork")
+    if batchreads < 1:
+        logger.error("invalid number of batch reads %s", batchreads)
+        parser.error("Error: number of batch reads must be at least 1.")
+
+    if direct and readsize % mmap.PAGESIZE:
+        logger.error("read size %s is not a multiple of page size %d", readsize, mmap.PAGESIZE)
+        parser.error(f"Error: --direct requires read size to be a multiple of {mmap.PAGESIZE}.")
 
     children = {}
-    while True:
-        # exit if any child encountered a fatal error
-        for proc in children.values():
-            if proc.exitcode == 1:
-                log_error(f"terminating because a child encountered an error")
+    # devices whose children exited because the devices disappeared, or were killed
+    gone = set()
+    for iteration in itertools.count(1):
+        # Exit if any child encountered a fatal error. Otherwise, collect devices
+        # whose children exited since the last iteration. Children scan their devices
+        # repeatedly and only exit normally if the device disappears.
+        exited, killed = [], []
+        for devpath, proc in children.items():
+            if proc.exitcode is None:
+                continue
+            if proc.exitcode > 0:
+                logger.error("terminating because a child encountered an error")
                 [p.kill() for p in children.values() if p.is_alive()]
                 return
-        # (re)start device scans
-        for devpath in devpaths or discover_hdd_devices():
-            worker_args = (devpath, readsize, delay, slowthreshold, problembackoff)
-            # If we have started a scan on this device before,
-            # start a new scan if the old one finished.
-            if devpath in children:
-                if children[devpath].is_alive():
-                    continue
-                else:  # child exited; start new one
-                    children[devpath] = mp.Process(target=scan_device_wrapper, args=worker_args)
-                    children[devpath].start()
-            # If devpath not in children, then we haven't started any scans of
-            # this device before. Start a new scan from the middle of the device.
+            if proc.exitcode < 0:
+                # e.g. the OOM killer; this says nothing about the device
+                logger.warning("child scanning %s was killed by signal %d, restarting",
+                               devpath, -proc.exitcode)
+                killed.append(devpath)
             else:
-                children[devpath] = mp.Process(target=scan_device_wrapper, args=worker_args,
-                                               kwargs={'start_from_middle': True})
-                children[devpath].start()
+                exited.append(devpath)
+        # Explicitly specified devices are not expected to disappear
+        if devpaths and exited:
+            logger.error("terminating because device(s) disappeared: %s", sorted(exited))
+            [p.kill() for p in children.values() if p.is_alive()]
+            return
+        for devpath in exited + killed:
+            del children[devpath]
+            gone.add(devpath)
+        # The cached list of discovered devices may still contain devices whose
+        # children just exited because the devices were removed, so refresh it first.
+        if not devpaths and (exited or iteration % rediscovery_interval == 0):
+            discovered = discover_hdd_devices()
+        current_devpaths = set(devpaths or discovered)
+        # These devices disappeared at some point (or their children were killed),
+        # but are present now, so start scanning them again from the beginning. If
+        # a device is gone again by the time it is opened, its child will simply exit again.
+        for devpath in gone & current_devpaths:
+            gone.remove(devpath)
+            worker_args = (cpus, args.main_loop_sleep, idle, devpath, readsize, delay, slowthreshold,
+                           problembackoff)
+            children[devpath] = mp.Process(target=scan_device_wrapper, args=worker_args,
+                                           kwargs={'direct': direct, 'verbose': verbose,
+                                                   'batch_reads': batchreads})
+            children[devpath].start()
+        # If devpath is in neither children nor gone, then we haven't started any
+        # scans of this device before. Start a new scan from the middle of the device.
+        for devpath in current_devpaths.difference(children, gone):
+            worker_args = (cpus, args.main_loop_sleep, idle, devpath, readsize, delay, slowthreshold,
+                           problembackoff)
+            children[devpath] = mp.Process(target=scan_device_wrapper, args=worker_args,
+                                           kwargs={'start_from_middle': True, 'direct': direct,
+                                                   'verbose': verbose, 'batch_reads': batchreads})
+            children[devpath].start()
         sleep(args.main_loop_sleep)
 
 